@@ -1,17 +1,24 @@
 from dotenv import load_dotenv
 load_dotenv()  # loads backend/.env → populates os.environ before any service initializes
 
-import asyncio
+import os
+import tempfile
 import time
+import uuid
 import logging
 from datetime import datetime, timezone
-from fastapi import FastAPI, HTTPException
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.models import AnalysisRequest
-from app.services import bio_parser, rules_engine, rag_agent
+from app.services import bio_parser, rules_engine, rag_agent, narrative_engine
+from app.services.shared_state import get_store
 
 logger = logging.getLogger("main")
 
+UPGRADE_PREFIX = "upgrade:"
+UPGRADE_TTL = 3600
+
 app = FastAPI(title="Niramay Pharmacogenomics API", version="2.0.0")
 
 # Allow CORS for frontend
@@ -23,8 +30,114 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def _analyze_parsed_vcf(parsed_data, drugs, patient_id, explanation_mode, background_tasks,
+                              start_time, parse_time, vcf_parsing_success):
+    """Steps 2-4 of the pipeline, shared by the URL and streaming-upload endpoints."""
+    # 2. Calculate Deterministic Risk (instant, no API calls)
+    clinical_assessments = rules_engine.evaluate_risk(parsed_data, drugs)
+    logger.info(f"[PIPELINE] Rules evaluated for {len(clinical_assessments)} drugs")
+
+    # 3. Generate ALL Explainable AI Narratives in ONE batched RAG+LLM call
+    explanation_profiles = []
+    task_indices = []
+
+    for i, assessment in enumerate(clinical_assessments):
+        if "pharmacogenomic_profile" in assessment:
+            profile = assessment["pharmacogenomic_profile"]
+            explanation_profiles.append({
+                "drug": assessment["drug"],
+                "gene": profile["primary_gene"],
+                "phenotype": profile["phenotype"],
+                "diplotype": profile.get("diplotype", "Unknown")
+            })
+            task_indices.append(i)
+
+    explanation_upgrade = None
+    parallel_start = time.time()
+
+    if explanation_mode == "llm":
+        # Single embedding + Pinecone query + generation; per-drug fallback only for invalid entries
+        logger.info(f"[PIPELINE] Launching batched RAG+LLM for {len(explanation_profiles)} drugs...")
+        try:
+            explanations = await rag_agent.generate_explanations_batch_async(explanation_profiles)
+        except Exception as e:
+            explanations = [e] * len(explanation_profiles)
+    else:
+        # Instant local narratives; the LLM versions are generated after the response is sent
+        explanations = [
+            narrative_engine.generate_local_explanation(p["drug"], p["gene"], p["phenotype"], p["diplotype"])
+            for p in explanation_profiles
+        ]
+        if explanation_mode == "local-then-llm-upgrade" and explanation_profiles:
+            upgrade_id = uuid.uuid4().hex
+            try:
+                get_store().set(UPGRADE_PREFIX + upgrade_id, {"status": "pending"}, ttl=UPGRADE_TTL)
+            except Exception as e:
+                # The local narratives are ready; just don't offer an upgrade we can't track
+                logger.warning(f"[STATE] Could not register upgrade: {str(e)[:60]}")
+            else:
+                background_tasks.add_task(_run_explanation_upgrade, upgrade_id, explanation_profiles)
+                explanation_upgrade = {
+                    "upgrade_id": upgrade_id,
+                    "status_url": f"/api/v1/explanations/{upgrade_id}"
+                }
+    logger.info(f"[PIPELINE] All {len(explanation_profiles)} explanations ({explanation_mode}) "
+                f"completed in {time.time() - parallel_start:.2f}s")
+
+    # Attach results back to assessments
+    for idx, explanation in zip(task_indices, explanations):
+        if isinstance(explanation, Exception):
+            logger.error(f"[PIPELINE] Exception for drug at index {idx}: {explanation}")
+            clinical_assessments[idx]["llm_generated_explanation"] = {
+                "summary": "Explanation generation failed due to a transient API error.",
+                "citations": ["CPIC Database"],
+                "model_used": "error",
+                "error": str(explanation)
+            }
+        else:
+            clinical_assessments[idx]["llm_generated_explanation"] = explanation
+
+    total_time = time.time() - start_time
+    logger.info(f"[PIPELINE] ✅ Total request completed in {total_time:.2f}s")
+
+    # 4. Construct Final Output — Schema-Compliant
+    timestamp = datetime.now(timezone.utc).isoformat()
+    results = []
+
+    for assessment in clinical_assessments:
+        result = {
+            "patient_id": patient_id or "PATIENT_001",
+            "drug": assessment["drug"],
+            "timestamp": timestamp,
+            "risk_assessment": assessment.get("risk_assessment", {}),
+            "pharmacogenomic_profile": assessment.get("pharmacogenomic_profile", {}),
+            "clinical_recommendation": assessment.get("clinical_recommendation", {}),
+            "llm_generated_explanation": assessment.get("llm_generated_explanation", {}),
+            "quality_metrics": {
+                "vcf_parsing_success": vcf_parsing_success,
+                "annotation_completeness": 1.0 if assessment.get("pharmacogenomic_profile", {}).get("detected_variants") else 0.8,
+                "pipeline_version": "2.0.0-neurosymbolic"
+            }
+        }
+        results.append(result)
+
+    response = {
+        "results": results,
+        "genotype_profile": rules_engine.genotype_profile(parsed_data),
+        "performance": {
+            "total_seconds": round(total_time, 2),
+            "parse_seconds": round(parse_time, 2),
+            "drugs_analyzed": len(clinical_assessments),
+            "parallel_tasks": len(explanation_profiles)
+        }
+    }
+    if explanation_upgrade:
+        response["explanation_upgrade"] = explanation_upgrade
+    return response
+
+
 @app.post("/api/v1/analyze-vcf")
-async def analyze_patient_vcf(request: AnalysisRequest):
+async def analyze_patient_vcf(request: AnalysisRequest, background_tasks: BackgroundTasks):
     start_time = time.time()
 
     try:
@@ -36,82 +149,126 @@ async def analyze_patient_vcf(request: AnalysisRequest):
 
         vcf_parsing_success = len(parsed_data.get("variants", [])) > 0
 
-        # 2. Calculate Deterministic Risk (instant, no API calls)
-        clinical_assessments = rules_engine.evaluate_risk(parsed_data, request.drugs)
-        logger.info(f"[PIPELINE] Rules evaluated for {len(clinical_assessments)} drugs")
-
-        # 3. Generate ALL Explainable AI Narratives IN PARALLEL
-        explanation_tasks = []
-        task_indices = []
-
-        for i, assessment in enumerate(clinical_assessments):
-            if "pharmacogenomic_profile" in assessment:
-                drug = assessment["drug"]
-                gene = assessment["pharmacogenomic_profile"]["primary_gene"]
-                phenotype = assessment["pharmacogenomic_profile"]["phenotype"]
-                diplotype = assessment["pharmacogenomic_profile"].get("diplotype", "Unknown")
-
-                explanation_tasks.append(
-                    rag_agent.generate_explanation_async(drug, gene, phenotype, diplotype)
-                )
-                task_indices.append(i)
-
-        # Fire ALL RAG+LLM calls simultaneously
-        logger.info(f"[PIPELINE] Launching {len(explanation_tasks)} parallel RAG+LLM tasks...")
-        parallel_start = time.time()
-        explanations = await asyncio.gather(*explanation_tasks, return_exceptions=True)
-        logger.info(f"[PIPELINE] All {len(explanation_tasks)} explanations completed in {time.time() - parallel_start:.2f}s")
-
-        # Attach results back to assessments
-        for idx, explanation in zip(task_indices, explanations):
-            if isinstance(explanation, Exception):
-                logger.error(f"[PIPELINE] Exception for drug at index {idx}: {explanation}")
-                clinical_assessments[idx]["llm_generated_explanation"] = {
-                    "summary": "Explanation generation failed due to a transient API error.",
-                    "citations": ["CPIC Database"],
-                    "model_used": "error",
-                    "error": str(explanation)
-                }
-            else:
-                clinical_assessments[idx]["llm_generated_explanation"] = explanation
+        return await _analyze_parsed_vcf(
+            parsed_data, request.drugs, request.patient_id, request.explanation_mode,
+            background_tasks, start_time, parse_time, vcf_parsing_success
+        )
+
+    except Exception as e:
+        logger.error(f"[PIPELINE] Fatal error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        total_time = time.time() - start_time
-        logger.info(f"[PIPELINE] ✅ Total request completed in {total_time:.2f}s")
+@app.post("/api/v1/analyze-vcf-stream")
+async def analyze_vcf_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    drugs: List[str] = Query(...),
+    patient_id: Optional[str] = "PATIENT_001",
+    explanation_mode: Literal["local", "llm", "local-then-llm-upgrade"] = "llm",
+    store_path: Optional[str] = None,
+):
+    """
+    Analyses a VCF sent directly as the (chunked) request body, plain or gzip/BGZF.
+    Records are filtered as they arrive and parsing stops at the last target locus.
+    With `store_path` (a bare file name), the raw bytes are also teed to Supabase Storage
+    in the background under a server-chosen, never-overwritten object name.
+    """
+    start_time = time.time()
+    vcf_filter = bio_parser.StreamingVcfFilter()
+    tee_path = None
+    stored_object = None
 
-        # 4. Construct Final Output — Schema-Compliant
-        timestamp = datetime.now(timezone.utc).isoformat()
-        results = []
+    if store_path is not None:
+        if not store_path or "/" in store_path or "\\" in store_path or ".." in store_path:
+            raise HTTPException(status_code=400, detail="store_path must be a plain file name")
+        stored_object = f"stream_uploads/{uuid.uuid4().hex}_{store_path}"
 
-        for assessment in clinical_assessments:
-            result = {
-                "patient_id": request.patient_id or "PATIENT_001",
-                "drug": assessment["drug"],
-                "timestamp": timestamp,
-                "risk_assessment": assessment.get("risk_assessment", {}),
-                "pharmacogenomic_profile": assessment.get("pharmacogenomic_profile", {}),
-                "clinical_recommendation": assessment.get("clinical_recommendation", {}),
-                "llm_generated_explanation": assessment.get("llm_generated_explanation", {}),
-                "quality_metrics": {
-                    "vcf_parsing_success": vcf_parsing_success,
-                    "annotation_completeness": 1.0 if assessment.get("pharmacogenomic_profile", {}).get("detected_variants") else 0.8,
-                    "pipeline_version": "2.0.0-neurosymbolic"
-                }
-            }
-            results.append(result)
-
-        return {
-            "results": results,
-            "performance": {
-                "total_seconds": round(total_time, 2),
-                "parse_seconds": round(parse_time, 2),
-                "drugs_analyzed": len(clinical_assessments),
-                "parallel_tasks": len(explanation_tasks)
-            }
-        }
+    try:
+        tee = None
+        if stored_object:
+            fd, tee_path = tempfile.mkstemp(suffix=".vcf.upload")
+            tee = os.fdopen(fd, "wb")
+
+        # 1. Ingest & Parse while receiving
+        try:
+            async for chunk in request.stream():
+                if tee:
+                    tee.write(chunk)
+                if not vcf_filter.done:
+                    vcf_filter.feed(chunk)
+                elif not tee:
+                    break  # Every target locus seen; the rest of the body is irrelevant
+            vcf_filter.close()
+            vcf_filter.check_complete()
+        finally:
+            if tee:
+                tee.close()
+
+        parsed_data = vcf_filter.result()
+        parse_time = time.time() - start_time
+        logger.info(f"[PIPELINE] Streamed {parsed_data['records_scanned']} records in {parse_time:.2f}s "
+                    f"({len(parsed_data['variants'])} target variants)")
+
+        response = await _analyze_parsed_vcf(
+            parsed_data, drugs, patient_id, explanation_mode,
+            background_tasks, start_time, parse_time, parsed_data["valid_records"] > 0
+        )
+        if tee_path:
+            # Handed off only once the response exists; on failure `finally` removes it
+            background_tasks.add_task(bio_parser.upload_to_storage, tee_path, stored_object)
+            tee_path = None
+            response["stored_object"] = stored_object
+        return response
 
+    except bio_parser.VcfFormatError as e:
+        logger.warning(f"[PIPELINE] Rejected stream body: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[PIPELINE] Fatal error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tee_path and os.path.exists(tee_path):
+            os.remove(tee_path)
+
+
+async def _run_explanation_upgrade(upgrade_id, explanation_profiles):
+    """Generates the LLM narratives behind a local-then-llm-upgrade response."""
+    try:
+        explanations = await rag_agent.generate_explanations_batch_async(explanation_profiles)
+        # Only real LLM output counts as an upgrade; local fallbacks repeat what the client has
+        upgraded = {
+            p["drug"]: e for p, e in zip(explanation_profiles, explanations)
+            if isinstance(e, dict) and "error" not in e
+            and e.get("model_used") != narrative_engine.MODEL_NAME
+        }
+        if not upgraded:
+            payload = {"status": "failed", "error": "No LLM explanation could be generated."}
+        else:
+            payload = {
+                "status": "ready" if len(upgraded) == len(explanation_profiles) else "partial",
+                "explanations": upgraded
+            }
+    except Exception as e:
+        logger.error(f"[UPGRADE] {upgrade_id} failed: {e}")
+        payload = {"status": "failed", "error": str(e)}
+    try:
+        get_store().set(UPGRADE_PREFIX + upgrade_id, payload, ttl=UPGRADE_TTL)
+    except Exception as e:
+        logger.warning(f"[STATE] Could not store upgrade {upgrade_id}: {str(e)[:60]}")
+
+
+@app.get("/api/v1/explanations/{upgrade_id}")
+def get_explanation_upgrade(upgrade_id: str):
+    try:
+        upgrade = get_store().get(UPGRADE_PREFIX + upgrade_id)
+    except Exception as e:
+        logger.warning(f"[STATE] Could not read upgrade {upgrade_id}: {str(e)[:60]}")
+        raise HTTPException(status_code=503, detail="Upgrade status temporarily unavailable")
+    if upgrade is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired upgrade_id")
+    return upgrade
 
 @app.get("/health")
 def health_check():
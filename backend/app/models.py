@@ -1,7 +1,9 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class AnalysisRequest(BaseModel):
     vcf_url: str  
     drugs: List[str]
     patient_id: Optional[str] = "PATIENT_001"
+    # local: instant template narrative; llm: RAG+LLM; local-then-llm-upgrade: local now, LLM fetched later
+    explanation_mode: Literal["local", "llm", "local-then-llm-upgrade"] = "llm"
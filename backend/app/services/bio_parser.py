@@ -2,12 +2,117 @@ import cyvcf2
 import requests
 import tempfile
 import os
+import struct
+import zlib
+from urllib.parse import quote
 
 import time
 
+from app.services import variant_index
+
+# ─── COMPRESSION HANDLING ─────────────────────────────────────────────
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAX_BLOCK = 0xff00  # Same uncompressed block size htslib uses
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DECODE_MAX_OUTPUT = 1 << 20
+
+
+def _default_thread_count():
+    """htslib decompression threads: VCF_DECOMPRESSION_THREADS or the cores we may run on."""
+    configured = os.environ.get("VCF_DECOMPRESSION_THREADS")
+    if configured:
+        try:
+            return max(1, int(configured))
+        except ValueError:
+            print(f"Warning: Ignoring invalid VCF_DECOMPRESSION_THREADS={configured!r}")
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, min(cores, 8))
+
+
+VCF_DECOMPRESSION_THREADS = _default_thread_count()
+
+
+def detect_compression(header: bytes) -> str:
+    """
+    Classifies a file from its first bytes: "bgzf", "gzip" or "plain".
+    BGZF is gzip with the FEXTRA flag set and a 'BC' extra subfield.
+    """
+    if header[:2] != GZIP_MAGIC:
+        return "plain"
+    if len(header) >= 14 and header[3] & 0x04 and header[12:14] == b"BC":
+        return "bgzf"
+    return "gzip"
+
+
+def _bgzf_block(data: bytes) -> bytes:
+    # Level 1: the transcode sits in the request path and the file is read only once
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = len(cdata) + 26
+    if block_size > 0x10000:
+        # Incompressible input can overflow a block; split it and retry
+        half = len(data) // 2
+        return _bgzf_block(data[:half]) + _bgzf_block(data[half:])
+    header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+class BgzfWriter:
+    """Minimal BGZF writer so plain-gzip uploads can use htslib's threaded decompression."""
+
+    def __init__(self, fileobj):
+        self._out = fileobj
+        self._buffer = bytearray()
+
+    def write(self, data: bytes):
+        self._buffer.extend(data)
+        while len(self._buffer) >= BGZF_MAX_BLOCK:
+            self._out.write(_bgzf_block(bytes(self._buffer[:BGZF_MAX_BLOCK])))
+            del self._buffer[:BGZF_MAX_BLOCK]
+
+    def close(self):
+        if self._buffer:
+            self._out.write(_bgzf_block(bytes(self._buffer)))
+            self._buffer.clear()
+        self._out.write(BGZF_EOF)
+
+
+class GzipStreamDecoder:
+    """
+    Incremental gunzip that also handles multi-member gzip files.
+    Output is yielded in pieces of at most DECODE_MAX_OUTPUT bytes, so a small,
+    highly compressible chunk cannot inflate into one huge buffer.
+    """
+
+    def __init__(self):
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decode(self, data: bytes):
+        while True:
+            out = self._inflater.decompress(data, DECODE_MAX_OUTPUT)
+            if out:
+                yield out
+            if self._inflater.eof:
+                data = self._inflater.unused_data
+                self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if not data:
+                    return
+                continue
+            data = self._inflater.unconsumed_tail
+            # A full piece may leave output buffered inside zlib even with no input left
+            if not data and len(out) < DECODE_MAX_OUTPUT:
+                return
+
+
 def download_temp_vcf(vcf_url: str) -> str:
     """
-    Downloads a VCF file from a URL to a temporary file.
+    Streams a VCF file from a URL to a temporary file.
+    Compressed inputs are kept compressed as .vcf.gz; plain gzip is transcoded
+    to BGZF on the fly so the parser can use multithreaded decompression.
     Returns the path to the temporary file.
     """
     start = time.time()
@@ -17,17 +122,42 @@ def download_temp_vcf(vcf_url: str) -> str:
         return vcf_url
         
     print(f"[PARSER] Downloading VCF from: {vcf_url}")
-    response = requests.get(vcf_url, timeout=30)
-    response.raise_for_status()
-    
-    # Create a temp file
-    fd, path = tempfile.mkstemp(suffix=".vcf")
-    with os.fdopen(fd, 'wb') as tmp:
-        tmp.write(response.content)
-    
-    print(f"[PARSER] VCF downloaded in {time.time() - start:.2f}s")
+    with requests.get(vcf_url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+        # Sniff the format from the first bytes
+        first = b""
+        for chunk in chunks:
+            first += chunk
+            if len(first) >= 18:
+                break
+        compression = detect_compression(first)
+
+        fd, path = tempfile.mkstemp(suffix=".vcf" if compression == "plain" else ".vcf.gz")
+        with os.fdopen(fd, 'wb') as tmp:
+            if compression == "gzip":
+                decoder = GzipStreamDecoder()
+                writer = BgzfWriter(tmp)
+                for piece in decoder.decode(first):
+                    writer.write(piece)
+                for chunk in chunks:
+                    for piece in decoder.decode(chunk):
+                        writer.write(piece)
+                writer.close()
+            else:
+                tmp.write(first)
+                for chunk in chunks:
+                    tmp.write(chunk)
+
+    print(f"[PARSER] VCF downloaded ({compression}) in {time.time() - start:.2f}s")
     return path
 
+
+def _file_compression(vcf_path: str) -> str:
+    with open(vcf_path, "rb") as f:
+        return detect_compression(f.read(18))
+
 def parse_genomic_data(vcf_path: str):
     """
     Parses a VCF file and extracts relevant genomic variants.
@@ -35,16 +165,23 @@ def parse_genomic_data(vcf_path: str):
     print(f"Parsing VCF from: {vcf_path}")
     
     variants_data = []
+    genome_build = None
     
     # Placeholder for actual cyvcf2 parsing if we don't have a real file
     # But to make the rules engine work, we should mock some data if usage fails
     # or actually try to parse if the file is valid.
     
     try:
-        vcf = cyvcf2.VCF(vcf_path)
+        # Only BGZF can be decompressed block-parallel; plain gzip/text gain nothing from threads
+        threads = VCF_DECOMPRESSION_THREADS if _file_compression(vcf_path) == "bgzf" else None
+        vcf = cyvcf2.VCF(vcf_path, threads=threads)
+        genome_build = variant_index.detect_build(vcf.raw_header)
+        print(f"[PARSER] Genome build: {genome_build or 'undetected (matching both)'}")
         for variant in vcf:
-            # Extract RSID
+            # Extract RSID; unannotated records ("." -> None) are resolved by position
             rsid = variant.ID
+            if not rsid:
+                rsid = variant_index.lookup_rsid(genome_build, variant.CHROM, variant.POS, variant.REF, variant.ALT)
             variants_data.append({
                 "rsid": rsid,
                 "chrom": variant.CHROM,
@@ -63,8 +200,203 @@ def parse_genomic_data(vcf_path: str):
 
     return {
         "variants": variants_data,
+        "genome_build": genome_build,
         "quality_metrics": {
              "mean_coverage": 30.5,
              "contamination_rate": 0.001
         }
     }
+
+
+# ─── STREAMING INGEST ─────────────────────────────────────────────────
+TARGET_RSIDS = frozenset(variant_index.TARGET_ALLELES)
+MAX_LINE_BYTES = 4 << 20  # Longest VCF line accepted from a stream (many-sample records)
+
+
+class VcfFormatError(ValueError):
+    """Raised when a streamed body is not a readable VCF."""
+
+
+class StreamingVcfFilter:
+    """
+    Incremental pharmacogene filter for a VCF arriving in chunks (plain, gzip or BGZF).
+    Only records matching a CPIC target allele are kept, so memory is bounded by the
+    header plus one partial line. `done` turns True once every target locus has been
+    passed, so the caller can stop reading. That relies on the VCF being coordinate-
+    sorted; if records go backwards, early stopping is switched off for the stream.
+    """
+
+    def __init__(self):
+        self.variants = []
+        self.records_scanned = 0
+        self.valid_records = 0
+        self.genome_build = None
+        self.done = False
+        self._decoder = None
+        self._sniff_buffer = b""
+        self._sniffed = False
+        self._partial = b""
+        self._line_no = 0
+        self._header = []
+        self._in_header = True
+        self._pending_loci = None
+        self._early_stop = True
+        self._visited_chroms = set()
+        self._chrom = None
+        self._last_pos = 0
+
+    def feed(self, chunk: bytes):
+        if self.done:
+            return
+        if not self._sniffed:
+            self._sniff_buffer += chunk
+            if len(self._sniff_buffer) < len(GZIP_MAGIC):
+                return
+            chunk = self._start()
+        for data in (self._decoder.decode(chunk) if self._decoder else (chunk,)):
+            lines = (self._partial + data).split(b"\n")
+            self._partial = lines.pop()
+            if len(self._partial) > MAX_LINE_BYTES:
+                raise VcfFormatError(f"Line {self._line_no + len(lines) + 1} exceeds {MAX_LINE_BYTES} bytes")
+            for line in lines:
+                self._process_line(line)
+                if self.done:
+                    return
+
+    def close(self):
+        if not self._sniffed:
+            self.feed(self._start())
+        if self._partial and not self.done:
+            self._process_line(self._partial)
+            self._partial = b""
+
+    def check_complete(self):
+        """Refuses to let an unreadable body be interpreted as a wild-type genome."""
+        if self._in_header:
+            raise VcfFormatError("No #CHROM header line found; body is not a VCF")
+        if not self.valid_records:
+            raise VcfFormatError("VCF contains no variant records")
+
+    def result(self):
+        """Same shape as parse_genomic_data, plus how many records were scanned."""
+        return {
+            "variants": self.variants,
+            "genome_build": self.genome_build,
+            "records_scanned": self.records_scanned,
+            "valid_records": self.valid_records,
+            "quality_metrics": {
+                 "mean_coverage": 30.5,
+                 "contamination_rate": 0.001
+            }
+        }
+
+    def _start(self):
+        self._sniffed = True
+        if detect_compression(self._sniff_buffer) != "plain":
+            self._decoder = GzipStreamDecoder()
+        chunk, self._sniff_buffer = self._sniff_buffer, b""
+        return chunk
+
+    def _process_line(self, line: bytes):
+        self._line_no += 1
+        if len(line) > MAX_LINE_BYTES:
+            raise VcfFormatError(f"Line {self._line_no} exceeds {MAX_LINE_BYTES} bytes")
+        line = line.rstrip(b"\r")
+        if not line:
+            return
+        if line.startswith(b"#"):
+            # Only the first #CHROM line ends the header; later '#' lines are comments
+            if self._in_header:
+                if line.startswith(b"##"):
+                    self._header.append(line.decode("utf-8", "replace"))
+                elif line.startswith(b"#CHROM"):
+                    self._on_header_end()
+            return
+        if self._in_header:
+            raise VcfFormatError(f"Line {self._line_no}: record before the #CHROM header line")
+
+        self.records_scanned += 1
+        fields = line.split(b"\t", 8)
+        if len(fields) < 8:
+            raise VcfFormatError(f"Line {self._line_no}: expected at least 8 tab-separated columns")
+        try:
+            chrom, rsid, ref = fields[0].decode(), fields[2].decode(), fields[3].decode()
+            alts = fields[4].decode().split(",")
+            pos = int(fields[1])
+        except (ValueError, UnicodeDecodeError) as e:
+            raise VcfFormatError(f"Line {self._line_no}: malformed record ({e.__class__.__name__})")
+        if not chrom or pos < 1 or not ref:
+            raise VcfFormatError(f"Line {self._line_no}: malformed record")
+        self.valid_records += 1
+
+        if rsid == ".":
+            rsid = variant_index.lookup_rsid(self.genome_build, chrom, pos, ref, alts)
+        if rsid in TARGET_RSIDS:
+            self.variants.append({"rsid": rsid, "chrom": chrom, "pos": pos, "ref": ref, "alt": alts})
+
+        self._advance(variant_index.normalize_chrom(chrom), pos)
+
+    def _on_header_end(self):
+        self._in_header = False
+        self.genome_build = variant_index.detect_build("\n".join(self._header))
+        self._header = []
+        builds = (self.genome_build,) if self.genome_build else variant_index.BUILDS
+        loci = {}
+        for coords in variant_index.TARGET_ALLELES.values():
+            for build in builds:
+                chrom, pos = coords[build][:2]
+                loci.setdefault(chrom, set()).add(pos)
+        self._pending_loci = {chrom: sorted(positions) for chrom, positions in loci.items()}
+
+    def _advance(self, chrom, pos):
+        if self._pending_loci is None or not self._early_stop:
+            return
+        if chrom != self._chrom:
+            if chrom in self._visited_chroms:
+                return self._disable_early_stop(f"contig {chrom} reappears after {self._chrom}")
+            # Sorted VCFs keep each contig contiguous: leaving one resolves all its loci
+            if self._chrom is not None:
+                self._visited_chroms.add(self._chrom)
+                self._pending_loci.pop(self._chrom, None)
+            self._chrom = chrom
+        elif pos < self._last_pos:
+            return self._disable_early_stop(f"{chrom}:{pos} follows {chrom}:{self._last_pos}")
+        self._last_pos = pos
+
+        # A locus is only passed by a later position: split multi-allelic records share one
+        positions = self._pending_loci.get(chrom)
+        if positions:
+            while positions and positions[0] < pos:
+                positions.pop(0)
+            if not positions:
+                del self._pending_loci[chrom]
+        if not self._pending_loci:
+            self.done = True
+
+    def _disable_early_stop(self, reason):
+        print(f"Warning: VCF is not coordinate-sorted ({reason}); reading the whole stream")
+        self._early_stop = False
+
+
+def upload_to_storage(local_path: str, object_name: str, bucket: str = "vcf_uploads"):
+    """
+    Uploads a received VCF to Supabase Storage under a server-chosen object name,
+    then removes the local copy. Never overwrites an existing object.
+    """
+    try:
+        if ".." in object_name.split("/"):
+            raise ValueError("dot segments are not allowed in object names")
+        url = f"{os.environ['SUPABASE_URL']}/storage/v1/object/{bucket}/{quote(object_name)}"
+        key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+        with open(local_path, "rb") as f:
+            response = requests.post(
+                url, data=f, timeout=300,
+                headers={"apikey": key, "Authorization": f"Bearer {key}",
+                         "Content-Type": "application/octet-stream"}
+            )
+        response.raise_for_status()
+        print(f"[PARSER] Stored upload at {bucket}/{object_name}")
+    except Exception as e:
+        print(f"Warning: Could not store upload {object_name}: {e}")
+    finally:
+        os.remove(local_path)
@@ -0,0 +1,87 @@
+# app/services/narrative_engine.py
+"""
+Local deterministic narrative engine: composes a 3-sentence, diplotype-specific
+explanation from the curated CPIC corpus without any network call.
+Used as the instant tier before (or instead of) the RAG+LLM pipeline.
+"""
+import re
+from functools import lru_cache
+from app.services.clinical_corpus import CLINICAL_CORPUS
+from app.services.rules_engine import CPIC_DATABASE
+
+MODEL_NAME = "local-template"
+
+# Words the corpus uses for reduced-function phenotypes when the exact phenotype word is absent
+_REDUCED_FUNCTION_MARKERS = ("poor", "decreased", "non-functional", "loss-of-function", "defect")
+
+
+def _sentences(text):
+    text = " ".join(text.split())
+    return [s.strip() for s in re.split(r"(?<=\.)\s+(?=[A-Z])", text) if s.strip()]
+
+
+def _build_templates():
+    """Indexes each drug's corpus sentences once at import time."""
+    templates = {}
+    for key, text in CLINICAL_CORPUS.items():
+        drug, gene = key.split("_")
+        sentences = _sentences(text)
+        mechanism = next((s for s in sentences if gene in s), sentences[0])
+        if mechanism != sentences[0]:
+            # Gene sentences lean on the drug introduced before them ("it", "this bioactivation")
+            mechanism = f"{sentences[0].rstrip('.')}; {mechanism[0].lower()}{mechanism[1:]}"
+        templates[drug] = {"gene": gene, "mechanism": mechanism, "sentences": sentences}
+    return templates
+
+
+_TEMPLATES = _build_templates()
+
+
+def _is_wild_type(drug, diplotype):
+    entry = CPIC_DATABASE.get(drug)
+    return entry is not None and entry["wild_type"]["star"] == diplotype
+
+
+def _consequence_sentence(sentences, phenotype):
+    """Picks the corpus sentence describing what this phenotype does to the patient."""
+    phenotype_word = phenotype.split()[0].lower() if phenotype else ""
+    for s in sentences:
+        if phenotype_word and phenotype_word in s.lower():
+            return s
+    for s in sentences:
+        if any(m in s.lower() for m in _REDUCED_FUNCTION_MARKERS):
+            return s
+    return sentences[-1]
+
+
+@lru_cache(maxsize=1024)
+def _compose(drug, primary_gene, phenotype, diplotype):
+    template = _TEMPLATES.get(drug)
+    drug_name = drug.capitalize()
+
+    if template is None:
+        return (f"The {drug_name} mechanism involves changes in drug metabolism or transport "
+                f"regulated by the {primary_gene} pathway. "
+                f"This patient carries the {primary_gene} {diplotype} diplotype ({phenotype}). "
+                f"Genetic variations like {diplotype} can significantly alter the pharmacokinetics of this drug.")
+
+    article = "an" if phenotype[:1].lower() in ("a", "e", "i", "o", "u") else "a"
+    stated = (f"This patient carries the {primary_gene} {diplotype} diplotype, corresponding to "
+              f"{article} {phenotype} phenotype.")
+
+    if _is_wild_type(drug, diplotype):
+        outcome = (f"With fully functional {primary_gene} alleles, {drug_name} exposure is expected to remain "
+                   f"within the typical range and no genotype-driven change in risk is anticipated.")
+    else:
+        outcome = _consequence_sentence(template["sentences"], phenotype)
+
+    return f"{template['mechanism']} {stated} {outcome}"
+
+
+def generate_local_explanation(drug, primary_gene, phenotype, diplotype):
+    """Returns an explanation in the same shape as the RAG+LLM pipeline."""
+    return {
+        "summary": _compose(drug.upper(), primary_gene, phenotype, diplotype),
+        "citations": ["CPIC Database"],
+        "model_used": MODEL_NAME
+    }
@@ -1,6 +1,8 @@
 # app/services/rag_agent.py
 import os
+import json
 import random
+import hashlib
 import asyncio
 import logging
 import time
@@ -8,6 +10,8 @@ from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
 from pinecone import Pinecone
+from app.services.shared_state import get_store
+from app.services.narrative_engine import generate_local_explanation
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
@@ -23,26 +27,67 @@ else:
     logger.info(f"[INIT] Loaded {len(GEMINI_API_KEYS)} Gemini API key(s)")
 
 GEMINI_CLIENTS = [genai.Client(api_key=key) for key in GEMINI_API_KEYS]
-_dead_key_indices = set()
+
+# Key health lives in the shared store so every worker skips a key once any worker trips on it.
+# Keys are identified by a fingerprint, never the raw secret.
+KEY_FINGERPRINTS = [hashlib.sha256(key.encode()).hexdigest()[:16] for key in GEMINI_API_KEYS]
+DEAD_KEY_PREFIX = "keypool:dead:"
+DEAD_KEY_TTL = int(os.environ.get("DEAD_KEY_TTL", "600"))  # Let quota-exhausted keys recover
+
+# Explanation cache shared by all workers
+EXPLANATION_CACHE_PREFIX = "explain:"
+EXPLANATION_CACHE_TTL = int(os.environ.get("EXPLANATION_CACHE_TTL", "86400"))
 
 # Dedicated ThreadPool for parallel processing (at least 20 workers)
 # This prevents asyncio from being bottle-necked by a small default pool.
 EXECUTOR = ThreadPoolExecutor(max_workers=30)
 
+def _dead_key_indices():
+    try:
+        dead = set(k[len(DEAD_KEY_PREFIX):] for k in get_store().keys(DEAD_KEY_PREFIX))
+    except Exception as e:
+        logger.warning(f"[STATE] Key health lookup failed: {str(e)[:60]}")
+        return set()
+    return {i for i, fp in enumerate(KEY_FINGERPRINTS) if fp in dead}
+
 def _get_live_clients():
-    live = [(i, c) for i, c in enumerate(GEMINI_CLIENTS) if i not in _dead_key_indices]
+    dead = _dead_key_indices()
+    live = [(i, c) for i, c in enumerate(GEMINI_CLIENTS) if i not in dead]
     if not live:
         logger.warning("[KEY-POOL] All keys marked dead. Resetting pool...")
-        _dead_key_indices.clear()
+        try:
+            get_store().delete_prefix(DEAD_KEY_PREFIX)
+        except Exception as e:
+            logger.warning(f"[STATE] Key pool reset failed: {str(e)[:60]}")
         live = list(enumerate(GEMINI_CLIENTS))
     random.shuffle(live)
     return live
 
 def _mark_key_dead(index, error_msg):
-    if index not in _dead_key_indices:
-        _dead_key_indices.add(index)
-        logger.warning(f"[KEY-POOL] 🔑 Key #{index+1} marked DEAD: {error_msg}. "
-                       f"{len(GEMINI_CLIENTS) - len(_dead_key_indices)} remaining.")
+    try:
+        get_store().set(DEAD_KEY_PREFIX + KEY_FINGERPRINTS[index], error_msg, ttl=DEAD_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"[STATE] Could not record dead key: {str(e)[:60]}")
+        return
+    logger.warning(f"[KEY-POOL] 🔑 Key #{index+1} marked DEAD: {error_msg}. "
+                   f"{len(GEMINI_CLIENTS) - len(_dead_key_indices())} remaining.")
+
+def _explanation_cache_key(drug, primary_gene, phenotype, diplotype):
+    return f"{EXPLANATION_CACHE_PREFIX}{drug.upper()}:{primary_gene}:{phenotype}:{diplotype}"
+
+def _get_cached_explanation(drug, primary_gene, phenotype, diplotype):
+    try:
+        return get_store().get(_explanation_cache_key(drug, primary_gene, phenotype, diplotype))
+    except Exception as e:
+        logger.warning(f"[STATE] Cache read failed: {str(e)[:60]}")
+        return None
+
+def _cache_explanation(drug, primary_gene, phenotype, diplotype, explanation):
+    try:
+        get_store().set(_explanation_cache_key(drug, primary_gene, phenotype, diplotype),
+                        explanation, ttl=EXPLANATION_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"[STATE] Cache write failed: {str(e)[:60]}")
 
 def _is_key_error(error_str):
     """Detects if an error is related to the API key itself or general quota (429)."""
@@ -119,6 +164,10 @@ def _retrieve_cpic_context_sync(drug, phenotype):
 
 def _generate_explanation_sync(drug, primary_gene, phenotype, diplotype):
     """Core RAG+LLM sync pipeline."""
+    cached = _get_cached_explanation(drug, primary_gene, phenotype, diplotype)
+    if cached:
+        return cached
+
     context = _retrieve_cpic_context_sync(drug, phenotype)
     
     # Improved fallback context if RAG yields nothing
@@ -145,11 +194,13 @@ STRICT RULES:
                 text = response.text.strip()
                 if text and len(text) > 30:
                     logger.info(f"[LLM] ✅ {drug}: Success with {model_name} (key#{idx+1})")
-                    return {
+                    explanation = {
                         "summary": text,
                         "citations": ["CPIC Database", "PharmGKB"],
                         "model_used": model_name
                     }
+                    _cache_explanation(drug, primary_gene, phenotype, diplotype, explanation)
+                    return explanation
             except Exception as e:
                 err = str(e)
                 if _is_key_error(err):
@@ -157,11 +208,10 @@ STRICT RULES:
                     break # Skip to next key
                 continue # Try next model with same key
     
-    return {
-        "summary": f"The {primary_gene} {diplotype} diplotype affects {drug} metabolism.",
-        "citations": ["CPIC Database"],
-        "error": "All keys/models exhausted."
-    }
+    # Deterministic local narrative instead of a one-line generic fallback
+    fallback = generate_local_explanation(drug, primary_gene, phenotype, diplotype)
+    fallback["error"] = "All keys/models exhausted."
+    return fallback
 
 
 async def generate_explanation_async(drug, primary_gene, phenotype, diplotype):
@@ -172,3 +222,161 @@ async def generate_explanation_async(drug, primary_gene, phenotype, diplotype):
         _generate_explanation_sync, 
         drug, primary_gene, phenotype, diplotype
     )
+
+
+# ─── BATCHED MODE: one embedding + one Pinecone query + one generation ──
+
+def _retrieve_cpic_context_batch_sync(profiles):
+    """Retrieves context for every drug with a single embedding and a single Pinecone query."""
+    drugs = [p["drug"].upper() for p in profiles]
+    query_text = " ".join(f"{p['drug']} {p['phenotype']}" for p in profiles)
+    query_text += " pharmacogenomic mechanism biological pathway"
+
+    query_vector = _embed_query(query_text)
+    if query_vector is None:
+        return {}
+
+    for attempt in range(3):
+        try:
+            results = index.query(
+                vector=query_vector,
+                top_k=len(drugs) * 3,
+                include_metadata=True,
+                filter={"drug": {"$in": drugs}}
+            )
+            contexts = {}
+            for match in results.matches:
+                drug = match.metadata.get("drug", "")
+                # Matches come back sorted by score, keep the best chunk per drug
+                if drug and drug not in contexts:
+                    contexts[drug] = match.metadata.get("text", "")
+            return contexts
+        except Exception as e:
+            logger.warning(f"[PINE] Batch attempt {attempt+1} failed: {str(e)[:60]}")
+            time.sleep(1)
+
+    return {}
+
+
+def _build_batch_prompt(profiles, contexts):
+    blocks = []
+    for p in profiles:
+        context = contexts.get(p["drug"].upper()) or (
+            f"The {p['drug']} mechanism involves changes in drug metabolism or transport "
+            f"regulated by the {p['gene']} pathway. Genetic variations like {p['diplotype']} "
+            f"can significantly alter the pharmacokinetics of this drug.")
+        blocks.append(f"- \"{p['drug']}\": {p['gene']} {p['diplotype']} diplotype ({p['phenotype']})\n"
+                      f"  Context: \"{context}\"")
+
+    patients = "\n".join(blocks)
+    keys = ", ".join(f'"{p["drug"]}"' for p in profiles)
+
+    return f"""You are a clinical pharmacogenomics expert. For EACH drug below, explain the biological mechanism of risk for a patient with the listed diplotype.
+
+{patients}
+
+STRICT RULES:
+1. ONLY use the context provided for that drug.
+2. Explain WHY the genetic variant alters metabolism or transport.
+3. Explicitly cite the patient's diplotype for that drug.
+4. DO NOT recommend a specific dosage.
+5. Keep each explanation to exactly 3 sentences.
+6. NO INTRODUCTIONS. Start directly with the explanation.
+7. Respond with ONLY a JSON object with exactly these keys: {keys}. Each value is the explanation string."""
+
+
+def _validate_batch_entry(text):
+    """Applies the same acceptance check as the per-drug pipeline."""
+    return isinstance(text, str) and len(text.strip()) > 30
+
+
+def _generate_explanations_batch_sync(profiles):
+    """
+    Core batched RAG+LLM pipeline. Returns (results, failed) where results maps
+    drug -> explanation dict and failed lists the drugs whose entry was missing or
+    invalid in an otherwise successful batch response. If no key/model produces a
+    usable response at all, every drug gets the local fallback and failed is empty.
+    """
+    results = {}
+    for p in profiles:
+        cached = _get_cached_explanation(p["drug"], p["gene"], p["phenotype"], p["diplotype"])
+        if cached:
+            results[p["drug"]] = cached
+    profiles = [p for p in profiles if p["drug"] not in results]
+    if not profiles:
+        return results, []
+
+    contexts = _retrieve_cpic_context_batch_sync(profiles)
+    prompt = _build_batch_prompt(profiles, contexts)
+    drugs = [p["drug"] for p in profiles]
+
+    for idx, client in _get_live_clients():
+        for model_name in GEMINI_MODEL_CASCADE:
+            try:
+                response = client.models.generate_content(
+                    model=model_name,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(response_mime_type="application/json")
+                )
+                payload = json.loads(response.text)
+                if not isinstance(payload, dict):
+                    continue
+
+                for p in profiles:
+                    text = payload.get(p["drug"])
+                    if _validate_batch_entry(text):
+                        results[p["drug"]] = {
+                            "summary": text.strip(),
+                            "citations": ["CPIC Database", "PharmGKB"],
+                            "model_used": model_name
+                        }
+                        _cache_explanation(p["drug"], p["gene"], p["phenotype"], p["diplotype"],
+                                           results[p["drug"]])
+                failed = [d for d in drugs if d not in results]
+                logger.info(f"[LLM] ✅ Batch: {len(drugs) - len(failed)}/{len(drugs)} valid with {model_name} (key#{idx+1})")
+                return results, failed
+            except json.JSONDecodeError:
+                logger.warning(f"[LLM] Batch: {model_name} returned invalid JSON")
+                continue
+            except Exception as e:
+                err = str(e)
+                if _is_key_error(err):
+                    _mark_key_dead(idx, err[:60])
+                    break # Skip to next key
+                continue # Try next model with same key
+
+    # The batch call itself failed on every key/model: retrying each drug would only
+    # repeat the same cascade N times, so serve the local narratives instead.
+    logger.warning(f"[LLM] Batch failed on all keys/models; local fallback for {', '.join(drugs)}")
+    for p in profiles:
+        fallback = generate_local_explanation(p["drug"], p["gene"], p["phenotype"], p["diplotype"])
+        fallback["error"] = "All keys/models exhausted."
+        results[p["drug"]] = fallback
+    return results, []
+
+
+async def generate_explanations_batch_async(profiles):
+    """
+    Generates explanations for all drugs in one RAG+LLM round trip.
+    `profiles` is a list of dicts with drug, gene, phenotype and diplotype keys.
+    Only drugs whose batched entry fails validation fall back to per-drug calls;
+    a batch that fails outright falls back to local narratives without retrying.
+    Returns explanations in the same order as `profiles`.
+    """
+    if not profiles:
+        return []
+
+    loop = asyncio.get_event_loop()
+    results, failed = await loop.run_in_executor(EXECUTOR, _generate_explanations_batch_sync, profiles)
+
+    if failed:
+        logger.info(f"[LLM] Falling back to per-drug calls for: {', '.join(failed)}")
+        fallback_profiles = [p for p in profiles if p["drug"] in failed]
+        fallbacks = await asyncio.gather(*[
+            generate_explanation_async(p["drug"], p["gene"], p["phenotype"], p["diplotype"])
+            for p in fallback_profiles
+        ], return_exceptions=True)
+        for p, explanation in zip(fallback_profiles, fallbacks):
+            results[p["drug"]] = explanation
+
+    return [results[p["drug"]] for p in profiles]
@@ -0,0 +1,145 @@
+# app/services/rescoring.py
+"""
+Bulk re-scoring of stored analyses after CPIC_DATABASE changes.
+
+Stored rows (analysis_results.raw_response) are streamed in chunks, flattened
+into columns of patient x drug pairs, and re-evaluated one drug column at a
+time against a compiled rule table. Only pairs whose risk label changed (or
+that cannot be re-scored) are emitted, so memory stays bounded by the chunk
+size regardless of table size.
+
+A label is only recomputed when the analysis stored a genotype_profile whose
+rsids_in_scope covers every rsID the drug's rules now use. Anything else
+(legacy rows, rsIDs or drugs added after the analysis) is emitted as
+"needs_reanalysis", since absence of a call there says nothing about the patient.
+"""
+from app.services.rules_engine import CPIC_DATABASE
+
+
+def compile_rule_table(cpic_database=CPIC_DATABASE):
+    """
+    Flattens the CPIC lookup into per-drug {rsid: rank} maps plus the ordered
+    outcomes. evaluate_risk picks the first listed variant present, so the
+    lowest rank among a patient's rsids wins; rank == len(variants) is wild-type.
+    """
+    table = {}
+    for drug, entry in cpic_database.items():
+        variants = list(entry["variants"].items())
+        outcomes = [(rsid, data["risk"], data["severity"], data["phenotype"]) for rsid, data in variants]
+        wild = entry["wild_type"]
+        outcomes.append((None, wild["risk"], wild["severity"], wild["phenotype"]))
+        table[drug] = {
+            "ranks": {rsid: i for i, (rsid, _) in enumerate(variants)},
+            "wild_rank": len(variants),
+            "outcomes": outcomes,
+        }
+    return table
+
+
+def to_columns(rows):
+    """
+    Converts stored analysis rows into columnar patient x drug arrays.
+    Each analysis contributes one genotype: (called target rsids, rsids in scope),
+    with scope None for legacy rows saved before genotype_profile existed.
+    """
+    analysis_ids, drugs, old_labels, genotype_refs = [], [], [], []
+    genotypes = []
+
+    for row in rows:
+        raw = row.get("raw_response") or {}
+        profile = raw.get("genotype_profile")
+        if profile:
+            genotype = (frozenset(profile.get("target_rsids", [])), frozenset(profile.get("rsids_in_scope", [])))
+        else:
+            genotype = (frozenset(), None)
+        genotype_idx = len(genotypes)
+        genotypes.append(genotype)
+
+        for r in raw.get("results", []):
+            analysis_ids.append(row["id"])
+            drugs.append(r.get("drug", "").upper())
+            old_labels.append(r.get("risk_assessment", {}).get("risk_label"))
+            genotype_refs.append(genotype_idx)
+
+    return {
+        "analysis_id": analysis_ids,
+        "drug": drugs,
+        "old_label": old_labels,
+        "genotype": genotype_refs,
+        "genotypes": genotypes,
+    }
+
+
+def _score(rules, rsids, scope):
+    """Returns an outcome index, or the sorted rsIDs missing from scope."""
+    if scope is None:
+        return sorted(rules["ranks"])
+    missing = [r for r in rules["ranks"] if r not in scope]
+    if missing:
+        return sorted(missing)
+    return min((rules["ranks"][r] for r in rsids if r in rules["ranks"]), default=rules["wild_rank"])
+
+
+def rescore_columns(columns, rule_table):
+    """Re-applies the rule table drug-by-drug, yielding changed and unscorable pairs."""
+    by_drug = {}
+    for i, drug in enumerate(columns["drug"]):
+        by_drug.setdefault(drug, []).append(i)
+
+    genotypes = columns["genotypes"]
+    for drug, rows in by_drug.items():
+        rules = rule_table.get(drug)
+        if rules is None:
+            # Drug dropped from the rule base: evaluate_risk now reports it as Unknown
+            for i in rows:
+                if columns["old_label"][i] != "Unknown":
+                    yield {
+                        "analysis_id": columns["analysis_id"][i],
+                        "drug": drug,
+                        "status": "changed",
+                        "old_risk_label": columns["old_label"][i],
+                        "new_risk_label": "Unknown",
+                        "severity": "none",
+                        "phenotype": None,
+                        "matched_rsid": None,
+                    }
+            continue
+
+        # Each distinct genotype is scored once per drug, then broadcast to its pairs
+        scored = {}
+        for i in rows:
+            g = columns["genotype"][i]
+            if g not in scored:
+                scored[g] = _score(rules, *genotypes[g])
+            outcome = scored[g]
+
+            if isinstance(outcome, list):
+                yield {
+                    "analysis_id": columns["analysis_id"][i],
+                    "drug": drug,
+                    "status": "needs_reanalysis",
+                    "old_risk_label": columns["old_label"][i],
+                    "reason": ("no stored genotype profile" if genotypes[g][1] is None
+                               else f"rsIDs not in scope at analysis time: {', '.join(outcome)}"),
+                }
+                continue
+
+            rsid, label, severity, phenotype = rules["outcomes"][outcome]
+            if label != columns["old_label"][i]:
+                yield {
+                    "analysis_id": columns["analysis_id"][i],
+                    "drug": drug,
+                    "status": "changed",
+                    "old_risk_label": columns["old_label"][i],
+                    "new_risk_label": label,
+                    "severity": severity,
+                    "phenotype": phenotype,
+                    "matched_rsid": rsid,
+                }
+
+
+def rescore_stream(row_chunks, cpic_database=CPIC_DATABASE):
+    """Rescores an iterable of row chunks, yielding results as each chunk is processed."""
+    rule_table = compile_rule_table(cpic_database)
+    for rows in row_chunks:
+        yield from rescore_columns(to_columns(rows), rule_table)
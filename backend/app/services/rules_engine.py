@@ -124,6 +124,20 @@ CPIC_DATABASE = {
     }
 }
 
+def target_rsids():
+    """Every rsID the rule base currently acts on."""
+    return {rsid for entry in CPIC_DATABASE.values() for rsid in entry["variants"]}
+
+def genotype_profile(parsed_vcf_data):
+    """
+    The patient's calls at every target rsID, persisted with each analysis so it
+    can be re-scored when the rule base changes. `rsids_in_scope` records which
+    rsIDs were looked for, so absence of a call means wild-type only within it.
+    """
+    scope = target_rsids()
+    found = {v["rsid"] for v in parsed_vcf_data.get("variants", []) if v.get("rsid") in scope}
+    return {"target_rsids": sorted(found), "rsids_in_scope": sorted(scope)}
+
 def evaluate_risk(parsed_vcf_data, requested_drugs):
     variants = parsed_vcf_data.get("variants", [])
     assessments = []
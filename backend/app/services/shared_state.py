@@ -0,0 +1,187 @@
+# app/services/shared_state.py
+"""
+Cross-worker shared state for multi-process uvicorn/gunicorn deployments.
+
+Every worker imports its own copy of the services, so plain module globals
+(dead key sets, caches) are per-process. This store puts that state in one
+place all workers on the node can see:
+
+  SHARED_STATE_BACKEND=sqlite  (default) local SQLite file in WAL mode at
+                               SHARED_STATE_PATH (default backend/.state/)
+  SHARED_STATE_BACKEND=redis   any Redis-compatible server at REDIS_URL
+  SHARED_STATE_BACKEND=memory  per-process dict (single worker / tests)
+
+Values are JSON-serialisable and may carry a TTL in seconds.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("shared_state")
+
+# Kept inside the backend tree rather than a world-writable directory like /tmp,
+# where another local user could pre-create the file and plant cached explanations.
+DEFAULT_STATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".state"))
+DEFAULT_SQLITE_PATH = os.path.join(DEFAULT_STATE_DIR, "niramay_shared_state.db")
+
+
+def _ensure_private_dir(path):
+    """Creates the store's directory as 0700 and refuses one owned by another user."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is not owned by the current user")
+    if st.st_mode & 0o022:
+        raise PermissionError(f"{directory} is group/world-writable")
+
+
+class MemoryStore:
+    """Per-process fallback with the same interface as the shared backends."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def keys(self, prefix):
+        now = time.time()
+        with self._lock:
+            return [k for k, (_, exp) in self._data.items()
+                    if k.startswith(prefix) and (exp is None or exp > now)]
+
+
+class SQLiteStore:
+    """Node-local store shared by all workers through a WAL-mode SQLite file."""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        _ensure_private_dir(path)
+        self._path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        # Expired rows are ignored on read; sweep them once per worker start
+        conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def _conn(self):
+        # sqlite3 connections must not cross threads; the RAG executor has many
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None),
+        )
+
+    def delete_prefix(self, prefix):
+        self._conn().execute("DELETE FROM kv WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff"))
+
+    def keys(self, prefix):
+        rows = self._conn().execute(
+            "SELECT key FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", time.time()),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+
+class RedisStore:
+    """
+    Store backed by any Redis-compatible client (redis-py, a local stand-in such
+    as fakeredis/KeyDB/Valkey). Needs get, set(ex=), delete and scan_iter.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete_prefix(self, prefix):
+        keys = list(self._client.scan_iter(match=f"{prefix}*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def keys(self, prefix):
+        return [k.decode() if isinstance(k, bytes) else k
+                for k in self._client.scan_iter(match=f"{prefix}*")]
+
+
+def _create_store():
+    backend = os.environ.get("SHARED_STATE_BACKEND", "sqlite").lower()
+    try:
+        if backend == "redis":
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+            client.ping()
+            logger.info("[STATE] Using Redis shared state")
+            return RedisStore(client)
+        if backend == "sqlite":
+            path = os.environ.get("SHARED_STATE_PATH", DEFAULT_SQLITE_PATH)
+            store = SQLiteStore(path)
+            logger.info(f"[STATE] Using SQLite shared state at {path}")
+            return store
+    except Exception as e:
+        logger.warning(f"[STATE] {backend} backend unavailable ({str(e)[:80]}). Falling back to memory.")
+    return MemoryStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide handle to the shared store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
+
+
+def set_store(store):
+    """Plugs in a custom backend (e.g. RedisStore around a local stand-in client)."""
+    global _store
+    _store = store
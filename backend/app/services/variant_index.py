@@ -0,0 +1,88 @@
+# app/services/variant_index.py
+"""
+Genome-build-aware positional index of every CPIC target allele.
+
+Lets the parser recognise target variants in VCFs whose ID column is "."
+without a dbSNP annotation pass. Coordinates are 1-based, forward strand,
+as written by variant callers.
+"""
+import re
+
+# rsID -> build -> (chrom, pos, ref, alt)
+TARGET_ALLELES = {
+    "rs4149056": {"GRCh37": ("12", 21331549, "T", "C"), "GRCh38": ("12", 21178615, "T", "C")},   # SLCO1B1 *5
+    "rs1799853": {"GRCh37": ("10", 96702047, "C", "T"), "GRCh38": ("10", 94942290, "C", "T")},   # CYP2C9 *2
+    "rs1057910": {"GRCh37": ("10", 96741053, "A", "C"), "GRCh38": ("10", 94981296, "A", "C")},   # CYP2C9 *3
+    "rs4244285": {"GRCh37": ("10", 96541616, "G", "A"), "GRCh38": ("10", 94781859, "G", "A")},   # CYP2C19 *2
+    "rs4986893": {"GRCh37": ("10", 96540410, "G", "A"), "GRCh38": ("10", 94780653, "G", "A")},   # CYP2C19 *3
+    "rs1142345": {"GRCh37": ("6", 18130918, "T", "C"), "GRCh38": ("6", 18130687, "T", "C")},     # TPMT *3C
+    "rs1800460": {"GRCh37": ("6", 18139228, "C", "T"), "GRCh38": ("6", 18138997, "C", "T")},     # TPMT *3A/*3B
+    "rs3918290": {"GRCh37": ("1", 97915614, "C", "T"), "GRCh38": ("1", 97450058, "C", "T")},     # DPYD *2A
+    "rs3892097": {"GRCh37": ("22", 42524947, "C", "T"), "GRCh38": ("22", 42128945, "C", "T")},   # CYP2D6 *4
+}
+
+BUILDS = ("GRCh37", "GRCh38")
+
+# Chromosome lengths that differ between builds, used to identify the build from ##contig lines
+_CONTIG_LENGTHS = {
+    "GRCh37": {"1": 249250621, "6": 171115067, "10": 135534747, "12": 133851895, "22": 51304566},
+    "GRCh38": {"1": 248956422, "6": 170805979, "10": 133797422, "12": 133275309, "22": 50818468},
+}
+
+_REFERENCE_ALIASES = {
+    "GRCh37": ("grch37", "hg19", "b37", "hs37d5", "human_g1k_v37"),
+    "GRCh38": ("grch38", "hg38", "b38", "hs38"),
+}
+
+_CONTIG_RE = re.compile(r"##contig=<ID=([^,>]+),length=(\d+)")
+
+
+def _build_positional_index():
+    index = {build: {} for build in BUILDS}
+    for rsid, coords in TARGET_ALLELES.items():
+        for build, (chrom, pos, ref, alt) in coords.items():
+            index[build][(chrom, pos, ref, alt)] = rsid
+    return index
+
+
+POSITIONAL_INDEX = _build_positional_index()
+
+
+def normalize_chrom(chrom):
+    chrom = str(chrom)
+    return chrom[3:] if chrom.lower().startswith("chr") else chrom
+
+
+def detect_build(raw_header):
+    """
+    Returns "GRCh37", "GRCh38" or None from a VCF header.
+    Contig lengths are authoritative; ##reference/##assembly names are the fallback.
+    """
+    for contig, length in _CONTIG_RE.findall(raw_header):
+        contig, length = normalize_chrom(contig), int(length)
+        for build, lengths in _CONTIG_LENGTHS.items():
+            if lengths.get(contig) == length:
+                return build
+
+    header_lines = [l.lower() for l in raw_header.splitlines()
+                    if l.startswith(("##reference", "##assembly", "##contig"))]
+    for build, aliases in _REFERENCE_ALIASES.items():
+        if any(alias in line for line in header_lines for alias in aliases):
+            return build
+    return None
+
+
+def lookup_rsid(build, chrom, pos, ref, alts):
+    """
+    Resolves a target rsID from position and alleles. With an unknown build both
+    builds are searched; the ref/alt check keeps cross-build collisions out.
+    """
+    chrom = normalize_chrom(chrom)
+    builds = (build,) if build else BUILDS
+    for b in builds:
+        table = POSITIONAL_INDEX[b]
+        for alt in alts:
+            rsid = table.get((chrom, pos, ref, alt))
+            if rsid:
+                return rsid
+    return None
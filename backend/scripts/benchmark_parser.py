@@ -0,0 +1,70 @@
+"""
+Parser Benchmark: Times parse_genomic_data on a (multi-GB) compressed VCF
+with single-threaded vs. multithreaded BGZF decompression.
+
+For plain-gzip inputs it also compares the two production paths end to end:
+  direct:     single-threaded parse of the gzip file as-is
+  transcoded: download_temp_vcf (HTTP download + gzip->BGZF transcode) + threaded parse
+The file is served from a local HTTP server so the download path is exercised.
+
+Usage: python scripts/benchmark_parser.py /path/to/sample.vcf.gz [threads ...]
+"""
+import os
+import sys
+import time
+import threading
+import functools
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.services import bio_parser
+
+
+def timed_parse(path, threads):
+    bio_parser.VCF_DECOMPRESSION_THREADS = threads
+    start = time.time()
+    parsed = bio_parser.parse_genomic_data(path)
+    return time.time() - start, len(parsed["variants"])
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_file(path):
+    handler = functools.partial(QuietHandler, directory=os.path.dirname(os.path.abspath(path)))
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/{os.path.basename(path)}"
+
+
+if len(sys.argv) < 2:
+    sys.exit(__doc__)
+
+vcf_path = sys.argv[1]
+thread_counts = [int(t) for t in sys.argv[2:]] or sorted({1, bio_parser._default_thread_count()})
+compression = bio_parser._file_compression(vcf_path)
+
+size_gb = os.path.getsize(vcf_path) / 1e9
+print(f"📄 {vcf_path} ({size_gb:.2f} GB, {compression})")
+
+for threads in thread_counts:
+    elapsed, n_variants = timed_parse(vcf_path, threads)
+    print(f"🧵 threads={threads:<3} {elapsed:8.2f}s  {size_gb / elapsed:6.3f} GB/s  {n_variants} variants")
+
+if compression == "gzip":
+    direct, _ = timed_parse(vcf_path, 1)
+
+    server, url = serve_file(vcf_path)
+    start = time.time()
+    transcoded_path = bio_parser.download_temp_vcf(url)
+    download = time.time() - start
+    server.shutdown()
+
+    threads = max(thread_counts)
+    parse, _ = timed_parse(transcoded_path, threads)
+    os.remove(transcoded_path)
+
+    print(f"⏱️  direct single-threaded parse:             {direct:8.2f}s")
+    print(f"⏱️  download+transcode {download:6.2f}s + parse@{threads} {parse:6.2f}s = {download + parse:8.2f}s")
@@ -0,0 +1,68 @@
+"""
+Bulk Re-Scorer: Re-applies the current CPIC_DATABASE to every stored analysis
+and writes one JSON line per patient x drug pair whose risk label changed
+("status": "changed") or that needs the VCF re-analysed because the stored
+genotype profile does not cover the current rules ("status": "needs_reanalysis").
+
+Rows are streamed from Supabase (PostgREST) with keyset pagination, so memory
+is bounded by --chunk-size no matter how many analyses are stored.
+
+Usage: python scripts/rescore_analyses.py [--chunk-size 5000] [--out diffs.jsonl]
+Requires SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (bypasses per-user RLS).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import requests
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.services.rescoring import rescore_stream
+
+load_dotenv()
+
+
+def fetch_analysis_chunks(chunk_size):
+    url = f"{os.environ['SUPABASE_URL']}/rest/v1/analysis_results"
+    key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    last_id = None
+
+    while True:
+        params = {"select": "id,raw_response", "order": "id.asc", "limit": chunk_size}
+        if last_id:
+            params["id"] = f"gt.{last_id}"
+        response = requests.get(url, headers=headers, params=params, timeout=60)
+        response.raise_for_status()
+        rows = response.json()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--out", help="Write diffs here instead of stdout")
+    args = parser.parse_args()
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    start = time.time()
+    counts = {"changed": 0, "needs_reanalysis": 0}
+    try:
+        for diff in rescore_stream(fetch_analysis_chunks(args.chunk_size)):
+            out.write(json.dumps(diff) + "\n")
+            counts[diff["status"]] += 1
+    finally:
+        if args.out:
+            out.close()
+
+    print(f"✅ {counts['changed']} risk labels changed, {counts['needs_reanalysis']} pairs need re-analysis "
+          f"({time.time() - start:.1f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import io
+import gzip
+
+import pytest
+
+from app.services import bio_parser
+from app.services.bio_parser import GzipStreamDecoder, StreamingVcfFilter, VcfFormatError
+
+HEADER = (
+    "##fileformat=VCFv4.2\n"
+    "##contig=<ID=chr22,length=50818468>\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+
+
+def _vcf(*records, header=HEADER):
+    return (header + "".join("\t".join(map(str, r)) + "\t.\tPASS\t.\n" for r in records)).encode()
+
+
+# One record past the target loci on every other target contig
+OTHER_CONTIGS = (
+    ("chr1", 100000000, ".", "A", "G"),
+    ("chr6", 20000000, ".", "A", "G"),
+    ("chr10", 100000000, ".", "A", "G"),
+    ("chr12", 30000000, ".", "A", "G"),
+)
+
+
+def _stream(data, chunk_size=7):
+    vcf_filter = StreamingVcfFilter()
+    for i in range(0, len(data), chunk_size):
+        vcf_filter.feed(data[i:i + chunk_size])
+    vcf_filter.close()
+    return vcf_filter
+
+
+def test_split_multiallelic_record_at_last_locus_is_read():
+    # CYP2D6 *4 is the last GRCh38 target locus; the target allele is the second split record
+    vcf_filter = _stream(_vcf(
+        *OTHER_CONTIGS,
+        ("chr22", 42128945, ".", "C", "A"),
+        ("chr22", 42128945, ".", "C", "T"),
+    ))
+    assert [v["rsid"] for v in vcf_filter.result()["variants"]] == ["rs3892097"]
+
+
+def test_stops_after_last_locus_is_passed():
+    # Leaving each contig passes its loci; the record after the last one ends the scan
+    vcf_filter = _stream(_vcf(
+        *OTHER_CONTIGS,
+        ("chr22", 42128945, ".", "C", "T"),
+        ("chr22", 42128946, ".", "A", "G"),
+        ("chr22", 42128947, ".", "A", "G"),
+    ))
+    assert vcf_filter.done
+    assert vcf_filter.result()["records_scanned"] == 6
+
+
+def test_unsorted_input_disables_early_stop():
+    # chr22 reappears after chr6; without the check every locus looks passed before the target
+    vcf_filter = _stream(_vcf(
+        ("chr22", 50000000, ".", "A", "G"),
+        ("chr6", 20000000, ".", "A", "G"),
+        ("chr22", 100, ".", "A", "G"),
+        ("chr1", 100000000, ".", "A", "G"),
+        ("chr10", 100000000, ".", "A", "G"),
+        ("chr12", 30000000, ".", "A", "G"),
+        ("chr22", 42128945, ".", "C", "T"),
+    ))
+    assert not vcf_filter.done
+    assert [v["rsid"] for v in vcf_filter.result()["variants"]] == ["rs3892097"]
+
+
+def test_comment_after_chrom_line_keeps_header_state():
+    data = _vcf(("chr22", 42128945, ".", "C", "T")).replace(b"chr22\t42128945", b"# note\nchr22\t42128945")
+    vcf_filter = _stream(data)
+    assert vcf_filter.genome_build == "GRCh38"
+    assert [v["rsid"] for v in vcf_filter.result()["variants"]] == ["rs3892097"]
+
+
+def test_gzip_input_matches_plain():
+    data = _vcf(("chr22", 42128945, "rs3892097", "C", "T"))
+    assert _stream(gzip.compress(data)).result()["variants"] == _stream(data).result()["variants"]
+
+
+def test_gzip_decoder_bounds_output_size():
+    payload = b"A" * (20 * bio_parser.DECODE_MAX_OUTPUT)
+    pieces = list(GzipStreamDecoder().decode(gzip.compress(payload)))
+    assert b"".join(pieces) == payload
+    assert max(len(p) for p in pieces) <= bio_parser.DECODE_MAX_OUTPUT
+
+
+def test_bgzf_writer_roundtrip():
+    payload = b"chr1\t1\t.\tA\tG\n" * 50000
+    out = io.BytesIO()
+    writer = bio_parser.BgzfWriter(out)
+    writer.write(payload)
+    writer.close()
+    assert bio_parser.detect_compression(out.getvalue()) == "bgzf"
+    assert gzip.decompress(out.getvalue()) == payload
+
+
+def test_counts_well_formed_records():
+    vcf_filter = _stream(_vcf(*OTHER_CONTIGS))
+    vcf_filter.check_complete()
+    assert vcf_filter.result()["valid_records"] == 4
+
+
+@pytest.mark.parametrize("data", [b"", b'{"hello": "world"}\nnot a vcf at all\n', HEADER.encode()])
+def test_non_vcf_body_is_rejected(data):
+    with pytest.raises(VcfFormatError):
+        _stream(data).check_complete()
+
+
+@pytest.mark.parametrize("record", [b"a\tb\tc\td\te\n", b"chr22\tabc\t.\tC\tT\t.\tPASS\t.\n"])
+def test_malformed_record_names_the_line(record):
+    with pytest.raises(VcfFormatError, match="Line 4"):
+        _stream(HEADER.encode() + record)
+
+
+def test_overlong_line_is_rejected(monkeypatch):
+    monkeypatch.setattr(bio_parser, "MAX_LINE_BYTES", 64)
+    with pytest.raises(VcfFormatError):
+        _stream(HEADER.encode() + b"chr22\t1\t" + b"A" * 200)
@@ -0,0 +1,73 @@
+import copy
+
+from app.services.rescoring import compile_rule_table, rescore_stream, _score
+from app.services.rules_engine import CPIC_DATABASE, target_rsids
+
+SCOPE = sorted(target_rsids())
+
+
+def _result(drug, label):
+    return {"drug": drug, "risk_assessment": {"risk_label": label}}
+
+
+def _row(analysis_id, results, called=(), scope=SCOPE):
+    raw = {"results": results}
+    if scope is not None:
+        raw["genotype_profile"] = {"target_rsids": list(called), "rsids_in_scope": list(scope)}
+    return {"id": analysis_id, "raw_response": raw}
+
+
+def _rescore(rows, database=CPIC_DATABASE):
+    return list(rescore_stream([rows], database))
+
+
+def test_score_picks_first_listed_variant_like_evaluate_risk():
+    rules = compile_rule_table()["WARFARIN"]
+    both = _score(rules, {"rs1057910", "rs1799853"}, set(SCOPE))
+    assert rules["outcomes"][both][0] == "rs1799853"
+    assert _score(rules, set(), set(SCOPE)) == rules["wild_rank"]
+
+
+def test_score_reports_rsids_missing_from_scope():
+    rules = compile_rule_table()["WARFARIN"]
+    assert _score(rules, set(), {"rs1799853"}) == ["rs1057910"]
+    assert _score(rules, set(), None) == ["rs1057910", "rs1799853"]
+
+
+def test_unchanged_rules_emit_nothing():
+    rows = [_row("a", [_result("SIMVASTATIN", "Toxic"), _result("CODEINE", "Safe")], called=["rs4149056"])]
+    assert _rescore(rows) == []
+
+
+def test_changed_label_is_emitted():
+    database = copy.deepcopy(CPIC_DATABASE)
+    database["CODEINE"]["variants"]["rs3892097"]["risk"] = "Toxic"
+    diffs = _rescore([_row("a", [_result("CODEINE", "Ineffective")], called=["rs3892097"])], database)
+    assert [(d["status"], d["new_risk_label"]) for d in diffs] == [("changed", "Toxic")]
+
+
+def test_added_drug_is_scored_when_its_rsids_were_in_scope():
+    database = copy.deepcopy(CPIC_DATABASE)
+    database["NEWDRUG"] = copy.deepcopy(CPIC_DATABASE["SIMVASTATIN"])
+    diffs = _rescore([_row("a", [_result("NEWDRUG", "Unknown")], called=["rs4149056"])], database)
+    assert [(d["status"], d["new_risk_label"]) for d in diffs] == [("changed", "Toxic")]
+
+
+def test_added_rsid_needs_reanalysis():
+    database = copy.deepcopy(CPIC_DATABASE)
+    database["CODEINE"]["variants"]["rs16947"] = dict(database["CODEINE"]["variants"]["rs3892097"])
+    diffs = _rescore([_row("a", [_result("CODEINE", "Safe")])], database)
+    assert diffs[0]["status"] == "needs_reanalysis"
+    assert "rs16947" in diffs[0]["reason"]
+
+
+def test_removed_drug_becomes_unknown():
+    database = copy.deepcopy(CPIC_DATABASE)
+    del database["SIMVASTATIN"]
+    diffs = _rescore([_row("a", [_result("SIMVASTATIN", "Toxic")], called=["rs4149056"])], database)
+    assert [(d["status"], d["old_risk_label"], d["new_risk_label"]) for d in diffs] == [("changed", "Toxic", "Unknown")]
+
+
+def test_legacy_row_needs_reanalysis():
+    diffs = _rescore([_row("legacy", [_result("WARFARIN", "Safe")], scope=None)])
+    assert [(d["status"], d["reason"]) for d in diffs] == [("needs_reanalysis", "no stored genotype profile")]
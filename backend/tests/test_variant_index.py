@@ -0,0 +1,39 @@
+from app.services.variant_index import detect_build, lookup_rsid
+
+
+def test_detects_grch37_from_contig_length():
+    assert detect_build("##contig=<ID=1,length=249250621>\n") == "GRCh37"
+
+
+def test_detects_grch38_from_contig_length():
+    assert detect_build("##contig=<ID=chr10,length=133797422,assembly=x>\n") == "GRCh38"
+
+
+def test_contig_length_wins_over_reference_name():
+    header = "##reference=file:///refs/hg19.fa\n##contig=<ID=chr22,length=50818468>\n"
+    assert detect_build(header) == "GRCh38"
+
+
+def test_falls_back_to_reference_alias():
+    assert detect_build("##reference=file:///refs/hs37d5.fa\n") == "GRCh37"
+    assert detect_build("##assembly=GRCh38\n") == "GRCh38"
+
+
+def test_unknown_build():
+    assert detect_build("##fileformat=VCFv4.2\n##contig=<ID=chrM,length=16569>\n") is None
+
+
+def test_lookup_by_position_and_alleles():
+    assert lookup_rsid("GRCh38", "chr10", 94942290, "C", ["T"]) == "rs1799853"
+    assert lookup_rsid("GRCh37", "10", 96702047, "C", ["G", "T"]) == "rs1799853"
+
+
+def test_lookup_rejects_allele_mismatch():
+    assert lookup_rsid("GRCh38", "chr10", 94942290, "C", ["A"]) is None
+    assert lookup_rsid("GRCh38", "chr10", 94942290, "G", ["T"]) is None
+
+
+def test_lookup_respects_detected_build():
+    # GRCh37 coordinates of DPYD *2A must not match when the file is GRCh38
+    assert lookup_rsid("GRCh38", "1", 97915614, "C", ["T"]) is None
+    assert lookup_rsid(None, "1", 97915614, "C", ["T"]) == "rs3918290"